@@ -1,5 +1,7 @@
-import json
 import pymupdf
+from sortedcontainers import SortedList
+
+from scrambler import json_loads
 
 class ManualScrambler:
     """Manually reorder pages of a PDF based on a JSON mapping.
@@ -24,8 +26,8 @@ class ManualScrambler:
         page_count = doc.page_count
 
         # Load moves from JSON
-        with open(self.json_path, 'r', encoding="utf-8") as f:
-            raw = json.load(f)
+        with open(self.json_path, 'rb') as f:
+            raw = json_loads(f.read())
 
         # Normalize to list of (orig_page, after_page) as ints (1-based)
         moves: list[tuple[int, int]] = []
@@ -44,35 +46,33 @@ class ManualScrambler:
         # Deterministic order: apply moves by ascending target page
         moves.sort(key=lambda x: (x[1], x[0]))
 
-        # Current order tracked by original page numbers (1-based)
-        order: list[int] = list(range(1, page_count + 1))
+        # Current order tracked as (position key, original page) pairs, pages
+        # 1-based. Moving a page only gives it a key between its new neighbours,
+        # so no list shifting is needed.
+        order = SortedList((float(p), p) for p in range(1, page_count + 1))
+        pos_of: dict[int, float] = {p: float(p) for p in range(1, page_count + 1)}
 
         for orig_page, after_page in moves:
             # Remove the page to move from its current position
-            if orig_page in order:
-                cur_idx = order.index(orig_page)
-                order.pop(cur_idx)
-            else:
-                # Already removed by a prior move of the same page; skip
-                continue
+            order.remove((pos_of[orig_page], orig_page))
 
-            # Find current position of the target page (by identity)
-            try:
-                after_idx = order.index(after_page)
-            except ValueError:
-                # Target page itself might have been moved already; still referenced by identity
-                # If truly missing, treat as appending to end
-                after_idx = len(order) - 1
+            # Find current key of the target page and of whatever follows it
+            after_key = pos_of[after_page]
+            succ_idx = order.bisect_right((after_key, page_count + 1))
+            next_key = order[succ_idx][0] if succ_idx < len(order) else after_key + 2.0
+            new_key = (after_key + next_key) / 2
 
-            insert_pos = after_idx + 1
-            order.insert(insert_pos, orig_page)
+            if not after_key < new_key < next_key:
+                # Repeated halving exhausted float precision; respace all keys
+                order = SortedList((float(i), p) for i, (_, p) in enumerate(order, start=1))
+                pos_of = {p: key for key, p in order}
+                after_key = pos_of[after_page]
+                new_key = after_key + 0.5
 
-        # Build the new document by copying pages in the computed order
-        new_doc = pymupdf.open()
-        for pnum in order:
-            src_index = pnum - 1  # convert 1-based to 0-based
-            new_doc.insert_pdf(doc, from_page=src_index, to_page=src_index)
+            order.add((new_key, orig_page))
+            pos_of[orig_page] = new_key
 
-        new_doc.save(self.output_path)
-        new_doc.close()
+        # Rewrite the page tree in the computed order; no page objects are copied
+        doc.select([pnum - 1 for _, pnum in order])  # convert 1-based to 0-based
+        doc.save(self.output_path, garbage=4, deflate=True)
         doc.close()
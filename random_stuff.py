@@ -1,11 +1,15 @@
 import pymupdf
 
-doc = pymupdf.open("firsted.pdf") # open a document
-page = doc[2]
-p0text = page.get_text()
+def main():
+    doc = pymupdf.open("firsted.pdf") # open a document
+    page = doc[2]
+    p0text = page.get_text()
 
-print(page.number)
+    print(page.number)
 
-with open("bobo.txt", "w", encoding="utf-8") as f:
-    if isinstance(p0text, str):
-        f.write(p0text)
+    with open("bobo.txt", "w", encoding="utf-8") as f:
+        if isinstance(p0text, str):
+            f.write(p0text)
+
+if __name__ == "__main__":
+    main()
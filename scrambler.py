@@ -1,19 +1,40 @@
 import pymupdf
 import re
-import json
+import dbm
+import hashlib
+import os
+import shelve
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from operator import itemgetter
 import time
 from typing import Literal
 try:
     import pytesseract
     pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-    from PIL import Image
-    import io
     HAS_OCR = True
 except ImportError:
     HAS_OCR = False
+try:
+    # orjson parses several times faster; the stdlib module reads the same input
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Max images per tesseract invocation; very long image lists can deadlock the pipe
+OCR_BATCH_SIZE = 50
+# No character whitelist: the clip is the whole bottom fifth, so it usually holds
+# body text too, which a whitelist would coerce into page-number-like strings
+OCR_CONFIG = '--psm 6'
+# Render scale for OCR clips; 72 DPI is too coarse for small footer digits.
+# Raise to 3 if faint scans stop matching.
+OCR_ZOOM = 2
 
-@dataclass
+# Footer page numbers like "3-12" or "S-4"; text extraction and OCR both misread "S" as "$"
+_PAGE_NUM_RE = re.compile(r"(\d+|S|\$)\W*\-\W*(\d+)\W*")
+
+@dataclass(slots=True)
 class Page:
     index: int
     failed: bool
@@ -25,13 +46,64 @@ class Page:
             return f"{self.index + 1}: No page number parsed"
         return f"{self.index + 1}: {self.chapter}-{self.chapter_page}"
 
+def _bottom_fifth(rect: pymupdf.Rect) -> pymupdf.Rect:
+    """The bottom 1/5th of a page, where the page number is printed."""
+    return pymupdf.Rect(
+        rect.x0,
+        rect.y1 - rect.height / 5,
+        rect.x1,
+        rect.y1
+    )
+
+def _last_page_number(text: str) -> re.Match[str] | None:
+    """Return the last `_PAGE_NUM_RE` match in `text`, or None."""
+    m = None
+    for m in _PAGE_NUM_RE.finditer(text):
+        pass
+    return m
+
+def _ocr_images(image_paths: list[str]) -> list[str]:
+    """Run tesseract once over a batch of images in a worker thread.
+
+    Returns one OCR string per image path, in order.
+    """
+    # Tesseract accepts a text file listing image paths
+    list_path = os.path.splitext(image_paths[0])[0] + ".txt"
+    with open(list_path, 'w', encoding="utf-8") as f:
+        f.write('\n'.join(image_paths))
+
+    text_all = pytesseract.image_to_string(list_path, config=OCR_CONFIG) #type: ignore
+    # Tesseract emits a form feed after each input image
+    return text_all.split('\f')[:len(image_paths)]
+
+def _ocr_cache_key(pix: pymupdf.Pixmap) -> str:
+    """Hash the raw pixels of a clip, plus the OCR settings, into a cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{pix.width}x{pix.height}x{pix.n} {OCR_CONFIG}".encode())
+    h.update(pix.samples_mv)
+    return h.hexdigest()
+
+def _open_ocr_cache(path: str, enabled: bool) -> shelve.Shelf:
+    """Open the OCR text cache, keyed by `_ocr_cache_key`.
+
+    Falls back to a throwaway in-memory shelf when disabled or when the
+    file at `path` cannot be opened.
+    """
+    if enabled:
+        try:
+            return shelve.open(path)
+        except dbm.error:  # includes OSError
+            pass
+    return shelve.Shelf({})
+
 class Scrambler:
     def __init__(self, fname: str):
+        self.fname = fname
         self.doc = pymupdf.open(fname)
         self.init_pages: list[Page] = []
         self.sorted_pages: list[Page] = []
     
-    def make_new_pdf(self, output_path: str = "rearranged.pdf", logging: bool = False, manual_json: str | None = None):
+    def make_new_pdf(self, output_path: str = "rearranged.pdf", logging: bool = False, manual_json: str | None = None, ocr_cache: bool = True):
         initial = time.time()
 
         print('_create_initial_page_list')
@@ -40,7 +112,7 @@ class Scrambler:
         initial = time.time()
 
         print('_ocr_failed_pages')
-        self._ocr_failed_pages(logging=logging)
+        self._ocr_failed_pages(logging=logging, ocr_cache=ocr_cache)
         print(time.time() - initial)
         initial = time.time()
 
@@ -60,35 +132,38 @@ class Scrambler:
         print(time.time() - initial)
     
     def _create_initial_page_list(self):
-        page_num_pattern = re.compile(r"(\d+|S|\$)\W*\-\W*(\d+)\W*")
-
         for page in self.doc:
             i = int(page.number) #type:ignore
-            text = page.get_text()
-            
-            if not isinstance(text, str):
-                continue
-                
-            res = page_num_pattern.findall(text)
+            # The page number is normally in the footer, so try that first and
+            # only parse the whole page if the footer has no match
+            text = page.get_text("text", clip=_bottom_fifth(page.rect))
+            m = _last_page_number(text) if isinstance(text, str) else None
+            if m is None:
+                text = page.get_text()
+                if not isinstance(text, str):
+                    continue
+                m = _last_page_number(text)
 
-            if len(res) == 0:
+            if m is None:
                 page_el = Page(i, True, 0, 0)
                 self.init_pages.append(page_el)
                 continue
             
-            numbs = res[-1]
-            first = numbs[0]
+            first = m.group(1)
             chapter = "S" if first == "S" or first == "$" else int(first)
-            chapter_page = int(numbs[1])
+            chapter_page = int(m.group(2))
 
             page_el = Page(i, False, chapter, chapter_page)
             self.init_pages.append(page_el)
 
-    def _ocr_failed_pages(self, logging: bool = False) -> None:
+    def _ocr_failed_pages(self, logging: bool = False, ocr_cache: bool = True) -> None:
         """Second pass: use OCR on pages where initial text extraction failed.
         
         Only processes pages with is_none=True. OCRs the bottom 1/5th of each
         page to save processing time, then applies the same regex pattern.
+        Clips already seen in a previous run are answered from the on-disk
+        OCR cache; the rest are OCR'd in a thread pool in batches of up to
+        OCR_BATCH_SIZE, each batch costing a single tesseract spawn.
         
         Args:
             logging: If True, write OCR details to ocr_log.txt including:
@@ -96,55 +171,90 @@ class Scrambler:
                      - Raw OCR text
                      - Whether regex matched
                      - Last regex match if available
+            ocr_cache: If True, reuse and store OCR results in <pdf>.ocrcache
+                       next to the input. If False, or if that file cannot be
+                       opened (e.g. a read-only directory), results are only
+                       kept in memory for this run.
         """
         if not HAS_OCR:
-            print("Warning: pytesseract and PIL not available. Skipping OCR pass.")
+            print("Warning: pytesseract not available. Skipping OCR pass.")
             return
         
-        page_num_pattern = re.compile(r"(\d+|S)\W*\-\W*(\d+)\W*")
         log_lines = []
-        
-        for idx, page_el in enumerate(self.init_pages):
-            if not page_el.failed:
-                continue  # Only process failed pages
-            
-            page = self.doc[page_el.index]
-            rect = page.rect
-            
-            # Define bottom 1/5th of the page
-            bottom_fifth = pymupdf.Rect(
-                rect.x0, 
-                rect.y1 - rect.height / 5, 
-                rect.x1, 
-                rect.y1
-            )
-            
-            # Get pixmap of bottom portion
-            pix = page.get_pixmap(clip=bottom_fifth)
-            
-            # Convert to PIL Image and run OCR
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data)) #type: ignore
-            text = pytesseract.image_to_string(img) #type: ignore
-            
+
+        failed = [(idx, page_el) for idx, page_el in enumerate(self.init_pages) if page_el.failed]
+        if not failed:
+            return
+        texts: dict[int, str] = {}
+
+        # Tesseract's own OpenMP threads would oversubscribe the cores
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+        with _open_ocr_cache(self.fname + '.ocrcache', ocr_cache) as cache, tempfile.TemporaryDirectory() as tmpdir:
+            misses: list[tuple[int, str]] = []
+            batches: list[list[str]] = []
+
+            # Spread clips over the workers, capped at OCR_BATCH_SIZE per tesseract run.
+            # Each clip is written to disk as soon as it is rendered, so no clip
+            # pixmaps are held across pages.
+            workers = os.cpu_count() or 1
+            batch_size = max(1, min(OCR_BATCH_SIZE, -(-len(failed) // workers)))
+
+            for idx, page_el in failed:
+                page = self.doc[page_el.index]
+                # Tesseract binarizes internally, so grayscale loses nothing and moves 1/3 the bytes
+                pix = page.get_pixmap(
+                    clip=_bottom_fifth(page.rect),
+                    matrix=pymupdf.Matrix(OCR_ZOOM, OCR_ZOOM),
+                    colorspace=pymupdf.csGRAY,
+                    alpha=False
+                )
+                key = _ocr_cache_key(pix)
+                if key in cache:
+                    texts[idx] = cache[key]
+                    # Free before the next page is rendered
+                    pix = None
+                    continue
+
+                # Write the bottom portion straight to disk for tesseract
+                image_path = os.path.join(tmpdir, f"{idx}.png")
+                pix.save(image_path)
+                pix = None
+
+                if not batches or len(batches[-1]) == batch_size:
+                    batches.append([])
+                batches[-1].append(image_path)
+                misses.append((idx, key))
+
+            if batches:
+                # pytesseract waits on a tesseract subprocess with the GIL released,
+                # so threads are enough to keep several tesseract runs going at once
+                with ThreadPoolExecutor(max_workers=workers) as ex:
+                    ocr_texts = [text for batch_texts in ex.map(_ocr_images, batches) for text in batch_texts]
+
+                for (idx, key), text in zip(misses, ocr_texts):
+                    cache[key] = text
+                    texts[idx] = text
+
+        for idx, page_el in failed:
+            text = texts.get(idx, "")
             # Apply same regex pattern
-            res = page_num_pattern.findall(text)
-            
+            m = _last_page_number(text)
+
             # Log information if logging enabled
             if logging:
                 log_lines.append(f"Page Index: {page_el.index}")
                 log_lines.append(f"Raw OCR Text: {repr(text)}")
-                log_lines.append(f"Regex Matched: {len(res) > 0}")
-                if len(res) > 0:
-                    log_lines.append(f"Last Match: {res[-1]}")
+                log_lines.append(f"Regex Matched: {m is not None}")
+                if m is not None:
+                    log_lines.append(f"Last Match: {m.groups()}")
                 log_lines.append("")
-            
-            if len(res) > 0:
-                numbs = res[-1]
-                first = numbs[0]
-                chapter = "S" if first == "S" else int(first)
-                chapter_page = int(numbs[1])
-                
+
+            if m is not None:
+                first = m.group(1)
+                chapter = "S" if first == "S" or first == "$" else int(first)
+                chapter_page = int(m.group(2))
+
                 # Replace the failed page with successful parse
                 self.init_pages[idx] = Page(page_el.index, False, chapter, chapter_page)
         
@@ -163,8 +273,12 @@ class Scrambler:
         Args:
             json_path: Path to the JSON file containing manual page adjustments
         """
-        with open(json_path, 'r', encoding="utf-8") as f:
-            adjustments = json.load(f)
+        with open(json_path, 'rb') as f:
+            adjustments = json_loads(f.read())
+
+        # Position of each page in init_pages. Not simply page.index, since pages
+        # whose text could not be extracted are left out of the list.
+        pos = {p.index: i for i, p in enumerate(self.init_pages)}
         
         for key, value in adjustments.items():
             # Key is offset by +1, so subtract 1 to get actual index
@@ -182,36 +296,40 @@ class Scrambler:
                 chapter = int(chapter)
             
             # Find and update the page in init_pages
-            for idx, page_el in enumerate(self.init_pages):
-                if page_el.index == page_index:
-                    # Replace with corrected page
-                    self.init_pages[idx] = Page(page_index, False, chapter, chapter_page)
-                    break
+            idx = pos.get(page_index)
+            if idx is not None:
+                # Replace with corrected page
+                self.init_pages[idx] = Page(page_index, False, chapter, chapter_page)
 
     def _rearrange_page_list(self) -> None:
-        def sort_key(p: Page):
-            if p.failed:
-                return (1, float("inf"), float("inf"), p.index)
-            chap_key = p.chapter if isinstance(p.chapter, int) else float("inf")
-            return (0, chap_key, p.chapter_page, p.index)
+        # Flags rather than a numeric sentinel push 'S' chapters and failed pages
+        # last, so no real chapter or page number can tie with or exceed them.
+        # Keys are unique since they end in p.index.
+        decorated = [
+            ((1, 0, 0, 0, p.index) if p.failed
+             else (0, 0, p.chapter, p.chapter_page, p.index) if isinstance(p.chapter, int)
+             else (0, 1, 0, p.chapter_page, p.index), p)
+            for p in self.init_pages
+        ]
+        decorated.sort(key=itemgetter(0))
 
         # Do not sort in place; produce a new sorted list
-        self.sorted_pages = sorted(self.init_pages, key=sort_key)
+        self.sorted_pages = [p for _, p in decorated]
 
     def _create_rearranged_pdf(self, output_path: str) -> None:
         """Create a new PDF whose pages are ordered by `self.sorted_pages`.
 
         Each element's `index` refers to the page number in the original
-        document (0-based). Pages are copied in that order to the new PDF.
+        document (0-based). This is the last step of the pipeline, so the
+        page tree of `self.doc` itself is rewritten in that order with
+        `select()` rather than re-opening the input: no page objects are
+        copied, but `self.doc` no longer matches `init_pages` afterwards.
         """
         if not self.sorted_pages:
             raise ValueError("sorted_pages is empty. Run rearrange_page_list() first.")
 
-        new_doc = pymupdf.open()
-        for p in self.sorted_pages:
-            new_doc.insert_pdf(self.doc, from_page=p.index, to_page=p.index)
-        new_doc.save(output_path)
-        new_doc.close()
+        self.doc.select([p.index for p in self.sorted_pages])
+        self.doc.save(output_path, garbage=4, deflate=True)
 
     def log(self, fname="log.txt"):
         with open(fname, 'w', encoding="utf-8") as f: